@@ -1,62 +1,862 @@
 """
 CareBridge Backend Server - Ollama Integration
-Python/Flask implementation
+Python/Quart (async) implementation
 
 Requirements:
-- Flask
-- flask-cors
+- Quart
+- quart-cors
 - ollama-python
+- httpx[http2]
+- Hypercorn
+- orjson
+- prometheus-client
 
 Install:
-pip install flask flask-cors ollama-python
+pip install -r requirements.txt
 
 Run:
-python app.py
+OLLAMA_NUM_PARALLEL=4 ollama serve
+GENERATION_SLOTS_PER_WORKER=1 hypercorn app:app --bind 0.0.0.0:3001 --workers 4 --worker-class asyncio
 """
 
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from quart import Quart, Response, g, request
+from quart_cors import cors
+import httpx
 import ollama
-import json
+import orjson
+import asyncio
+import functools
+import hashlib
 import logging
+import os
+import re
+import textwrap
+import time
+from collections import OrderedDict
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
 
-app = Flask(__name__)
-CORS(app)  # Enable CORS for frontend
+app = Quart(__name__)
+app = cors(app)  # Enable CORS for frontend
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # Configuration
-OLLAMA_MODEL = "mistral"  # or "llama2", "llama3.1"
+# Model tag per task. Summaries (and the bundle, which contains one) use the
+# more accurate Q8_0 quantization; the other tasks use Q4_K_M, which moves
+# half the bytes per token and decodes faster. Override with e.g.
+# OLLAMA_MODEL_TRANSLATE=llama3.1
+MODELS = {
+    'summarize': os.environ.get('OLLAMA_MODEL_SUMMARIZE', 'mistral:7b-instruct-q8_0'),
+    'bundle': os.environ.get('OLLAMA_MODEL_BUNDLE', 'mistral:7b-instruct-q8_0'),
+    'faq': os.environ.get('OLLAMA_MODEL_FAQ', 'mistral:7b-instruct-q4_K_M'),
+    'care': os.environ.get('OLLAMA_MODEL_CARE', 'mistral:7b-instruct-q4_K_M'),
+    'translate': os.environ.get('OLLAMA_MODEL_TRANSLATE', 'mistral:7b-instruct-q4_K_M'),
+}
+OLLAMA_HOST = os.environ.get('OLLAMA_HOST', 'http://localhost:11434')
+# Unix domain socket Ollama listens on when co-located (e.g. /tmp/ollama.sock).
+# Takes precedence over OLLAMA_HOST and skips the TCP loopback stack.
+OLLAMA_SOCKET = os.environ.get('OLLAMA_SOCKET')
+
+# Context window requested from Ollama for every call. All calls must use the
+# same value, otherwise Ollama reloads the model to resize its context.
+NUM_CTX = int(os.environ.get('OLLAMA_NUM_CTX', 8192))
+
+# Each endpoint accepts the longest input that still fits in NUM_CTX next to
+# its instructions and num_predict output budget (see input_limit). Longer
+# documents are rejected with 413, except by /api/summarize, which summarizes
+# them chunk by chunk up to MAX_SUMMARIZE_CHARS.
+MAX_SUMMARIZE_CHARS = int(os.environ.get('MAX_SUMMARIZE_CHARS', 96000))
+
+# Conservative characters-per-token estimate used to budget packed prompts
+# (medical text with numbers and abbreviations tokenizes densely).
+CHARS_PER_TOKEN = 3
+
+# Micro-batching: concurrent summarize/translate requests that arrive within
+# BATCH_WINDOW_MS of each other are sent to Ollama as one packed prompt.
+# Off by default (a packed prompt mixes several patients' documents); raise
+# BATCH_MAX_SIZE to opt in.
+BATCH_WINDOW_MS = int(os.environ.get('BATCH_WINDOW_MS', 10))
+BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', 1))
+
+# Identical requests (UI retries, switching languages back and forth) are
+# answered from an in-memory LRU of serialized responses.
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 512))
+
+# Generations allowed in flight at once from this worker. Across all workers
+# this should add up to the OLLAMA_NUM_PARALLEL that `ollama serve` runs with,
+# so extra requests wait here instead of piling up inside Ollama and shrinking
+# every request's share of the context memory.
+GENERATION_SLOTS_PER_WORKER = int(os.environ.get('GENERATION_SLOTS_PER_WORKER', 1))
+
+# The model is loaded into memory at startup and pinned there: every call,
+# including real generations, sends keep_alive=-1, because Ollama applies the
+# keep_alive of the latest request. A periodic ping reloads the model if Ollama
+# evicted it anyway (e.g. after a restart).
+KEEP_ALIVE_PING_SECONDS = int(os.environ.get('KEEP_ALIVE_PING_SECONDS', 300))
+
+# One async client per process so the HTTP connection pool is reused
+# across requests instead of opening a new session for every call.
+# Keep-alive connections skip the TCP/TLS handshake on each generation, and
+# HTTP/2 multiplexes concurrent requests when Ollama sits behind a TLS proxy.
+OLLAMA_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+OLLAMA_LIMITS = httpx.Limits(
+    max_keepalive_connections=40,
+    max_connections=100,
+    keepalive_expiry=30.0,
+)
+
+if OLLAMA_SOCKET:
+    # The host only fills in the URL; every request goes over the socket
+    client = ollama.AsyncClient(
+        host='http://localhost',
+        timeout=OLLAMA_TIMEOUT,
+        transport=httpx.AsyncHTTPTransport(uds=OLLAMA_SOCKET, limits=OLLAMA_LIMITS),
+    )
+else:
+    client = ollama.AsyncClient(
+        host=OLLAMA_HOST,
+        http2=True,
+        timeout=OLLAMA_TIMEOUT,
+        limits=OLLAMA_LIMITS,
+    )
+
+# ============================================
+# METRICS
+# ============================================
+
+# Exposed at /metrics. With several workers, set PROMETHEUS_MULTIPROC_DIR to
+# an empty directory so every worker's samples are aggregated.
+REQUEST_LATENCY = Histogram(
+    'carebridge_request_seconds',
+    'End-to-end request latency (until the last line of streamed responses)',
+    ['endpoint'],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'carebridge_requests_in_flight',
+    'Requests currently being handled',
+    ['endpoint'],
+    multiprocess_mode='livesum',
+)
+OLLAMA_WAITING = Gauge(
+    'carebridge_ollama_waiting',
+    'Generations queued for a free Ollama slot',
+    multiprocess_mode='livesum',
+)
+BATCH_QUEUE_DEPTH = Gauge(
+    'carebridge_batch_queue_depth',
+    'Documents waiting in the micro-batcher',
+    multiprocess_mode='livesum',
+)
+PROMPT_TOKENS = Counter(
+    'carebridge_prompt_tokens',
+    'Prompt tokens evaluated by Ollama',
+    ['model'],
+)
+OUTPUT_TOKENS = Counter(
+    'carebridge_output_tokens',
+    'Tokens generated by Ollama',
+    ['model'],
+)
+DECODE_TOKENS_PER_SECOND = Histogram(
+    'carebridge_decode_tokens_per_second',
+    'Decode throughput of a single generation',
+    ['model'],
+    buckets=(1, 2, 5, 10, 15, 20, 30, 40, 60, 80, 120, 200),
+)
+
+def record_usage(model, response):
+    """Record token counts and decode speed from a finished Ollama response"""
+    PROMPT_TOKENS.labels(model).inc(response.get('prompt_eval_count', 0))
+    OUTPUT_TOKENS.labels(model).inc(response.get('eval_count', 0))
+    if response.get('eval_count') and response.get('eval_duration'):
+        DECODE_TOKENS_PER_SECOND.labels(model).observe(
+            response['eval_count'] / (response['eval_duration'] / 1e9))
+
+def instrumented(endpoint):
+    """
+    Track latency and in-flight count of a view under the given endpoint label.
+    A streamed response takes over the tracking (see stream_generation) and
+    finishes it once its last line has been sent.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            in_flight = REQUESTS_IN_FLIGHT.labels(endpoint)
+            started = time.perf_counter()
+            
+            def finish():
+                in_flight.dec()
+                REQUEST_LATENCY.labels(endpoint).observe(time.perf_counter() - started)
+            
+            in_flight.inc()
+            g.finish_request = finish
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                # Still set unless a stream claimed it
+                finish_request = g.pop('finish_request', None)
+                if finish_request is not None:
+                    finish_request()
+        return wrapper
+    return decorator
+
+ollama_slots = asyncio.Semaphore(GENERATION_SLOTS_PER_WORKER)
+
+async def generate(**kwargs):
+    """Run one Ollama generation once a slot is free"""
+    with OLLAMA_WAITING.track_inprogress():
+        await ollama_slots.acquire()
+    try:
+        response = await client.generate(keep_alive=-1, **kwargs)
+    finally:
+        ollama_slots.release()
+    record_usage(kwargs['model'], response)
+    return response
+
+# ============================================
+# HELPERS
+# ============================================
+
+class ModelOutputError(ValueError):
+    """Model output parsed as JSON but doesn't have the expected shape"""
+
+# JSON wrapped in a markdown code fence, e.g. ```json [...] ```
+_FENCE = re.compile(r"```(?:json)?\s*([\[{].*?[\]}])\s*```", re.S)
+
+def parse_json_response(response_text):
+    """Parse model output as JSON, unwrapping a markdown code fence if present"""
+    try:
+        return orjson.loads(response_text)
+    except orjson.JSONDecodeError:
+        # JSON mode makes this rare, but tolerate fenced output
+        match = _FENCE.search(response_text)
+        if match is None:
+            raise
+        return orjson.loads(match.group(1))
+
+def was_truncated(response, num_predict):
+    """Whether generation was cut off at the num_predict cap instead of finishing"""
+    return response.get('done_reason') == 'length' or response.get('eval_count', 0) >= num_predict
+
+def json_list(result, key):
+    """Return the list of objects under `key`, or the result itself if it's already one"""
+    items = result if isinstance(result, list) else result.get(key) if isinstance(result, dict) else None
+    # Valid JSON of the wrong shape is as unusable as invalid JSON
+    if not isinstance(items, list):
+        raise ModelOutputError(f"Expected a list under {key!r}")
+    if not all(isinstance(item, dict) for item in items):
+        raise ModelOutputError(f"Expected a list of objects under {key!r}")
+    return items
+
+def add_faq_ids(faqs):
+    """Attach stable ids ("faq-1", "faq-2", ...) to generated FAQs"""
+    return [{**faq, 'id': f'faq-{i}'} for i, faq in enumerate(faqs, 1)]
+
+def add_care_ids(guidance):
+    """Attach numeric ids (1, 2, ...) to generated care guidance tasks"""
+    return [{**item, 'id': i} for i, item in enumerate(guidance, 1)]
+
+def input_limit(scaffold, options):
+    """
+    Longest input, in characters, that fits in NUM_CTX alongside the prompt
+    scaffold (the prompt built around empty text) and options['num_predict']
+    """
+    scaffold_tokens = len(scaffold) // CHARS_PER_TOKEN + 1
+    return (NUM_CTX - options['num_predict'] - scaffold_tokens) * CHARS_PER_TOKEN
+
+def text_too_long(text, limit):
+    """413 response for input longer than the model can take in one prompt"""
+    return json_response({
+        "error": f"Text too long ({len(text)} characters, maximum is {limit})",
+        "success": False
+    }), 413
+
+def split_document(text, max_chars):
+    """Split text into chunks of at most max_chars on paragraph boundaries"""
+    chunks = []
+    current = ''
+    for paragraph in text.split('\n\n'):
+        # A single oversized paragraph is wrapped on word boundaries
+        for piece in textwrap.wrap(paragraph, max_chars, replace_whitespace=False) or ['']:
+            if current and len(current) + 2 + len(piece) > max_chars:
+                chunks.append(current)
+                current = piece
+            else:
+                current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+# ============================================
+# RESPONSE CACHE
+# ============================================
+
+class ResponseCache:
+    """
+    Bounded LRU of already-serialized JSON response bodies. A hit skips the
+    LLM call and re-serialization entirely. Every access happens on the
+    event loop without awaiting, so no lock is needed.
+    """
+    
+    def __init__(self, max_entries=RESPONSE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+    
+    @staticmethod
+    def key(endpoint, text, *params):
+        """Hash the endpoint, generation parameters and normalized input text"""
+        raw = '|'.join([endpoint, *map(str, params), text.strip()])
+        return hashlib.blake2b(raw.encode(), digest_size=16).digest()
+    
+    def get(self, key):
+        body = self._entries.get(key)
+        if body is not None:
+            self._entries.move_to_end(key)
+        return body
+    
+    def put(self, key, body):
+        self._entries[key] = body
+        self._entries.move_to_end(key)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+response_cache = ResponseCache()
+
+async def read_json():
+    """Parse the request body with orjson; an empty or invalid body reads as {}"""
+    try:
+        data = orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def json_response(payload):
+    """Serialize a payload with orjson"""
+    return Response(orjson.dumps(payload), mimetype='application/json')
+
+def raw_json_response(body):
+    """Wrap an already-serialized JSON body in a response"""
+    return Response(body, mimetype='application/json')
+
+def cache_response(key, payload, truncated=False):
+    """
+    Serialize a successful payload, remember it under `key` and return it.
+    Output cut off at num_predict is flagged "truncated" and not cached, so
+    a retry can produce the full text.
+    """
+    if truncated:
+        return json_response({**payload, "truncated": True})
+    body = orjson.dumps(payload)
+    response_cache.put(key, body)
+    return raw_json_response(body)
+
+# ============================================
+# STREAMING
+# ============================================
+
+def ndjson_line(payload):
+    return orjson.dumps(payload) + b'\n'
+
+def stream_cached(body):
+    """Replay a cached response as a single final NDJSON line"""
+    return Response(ndjson_line({**orjson.loads(body), "done": True}),
+                    mimetype='application/x-ndjson')
+
+def stream_generation(model, prompt, options, cache_key, field, extra, truncated=False):
+    """
+    Stream tokens to the client as NDJSON while the model generates them:
+    one {"response": "...", "done": false} line per fragment, then a final
+    line holding the same payload the non-streaming endpoint returns, with
+    "done": true. The final payload is cached like a normal response unless
+    the output (or, via `truncated`, its input) was cut off at num_predict.
+    """
+    # The view returns before any line is generated, so request metrics are
+    # finished by the stream itself
+    finish_request = g.pop('finish_request', None)
+    
+    async def lines():
+        try:
+            async for line in generate_lines():
+                yield line
+        finally:
+            if finish_request is not None:
+                finish_request()
+    
+    async def generate_lines():
+        fragments = []
+        cut_off = truncated
+        try:
+            # Hold the slot until the stream is fully consumed
+            with OLLAMA_WAITING.track_inprogress():
+                await ollama_slots.acquire()
+            try:
+                parts = await client.generate(
+                    model=model,
+                    prompt=prompt,
+                    options=options,
+                    stream=True,
+                    keep_alive=-1
+                )
+                async for part in parts:
+                    if part['response']:
+                        fragments.append(part['response'])
+                        yield ndjson_line({"response": part['response'], "done": False})
+                    if part.get('done'):
+                        record_usage(model, part)
+                        cut_off = cut_off or was_truncated(part, options['num_predict'])
+            finally:
+                ollama_slots.release()
+        except Exception as e:
+            logger.error("Streaming error: %s", e)
+            yield ndjson_line({"error": str(e), "success": False, "done": True})
+            return
+        
+        payload = {field: ''.join(fragments).strip(), **extra, "success": True}
+        if cut_off:
+            payload["truncated"] = True
+        else:
+            response_cache.put(cache_key, orjson.dumps(payload))
+        yield ndjson_line({**payload, "done": True})
+    
+    return Response(lines(), mimetype='application/x-ndjson')
+
+# ============================================
+# PROMPTS
+# ============================================
+
+# num_predict caps each generation so decoding can't run far past a useful
+# answer; it bounds worst-case latency.
+SUMMARIZE_OPTIONS = {
+    'temperature': 0.7,
+    'top_p': 0.9,
+    'top_k': 40,
+    'num_predict': 512,
+    'num_ctx': NUM_CTX,
+}
+
+FAQ_OPTIONS = {
+    'temperature': 0.7,
+    'num_predict': 1024,
+    'num_ctx': NUM_CTX,
+}
+
+CARE_OPTIONS = {
+    'temperature': 0.7,
+    'num_predict': 1024,
+    'num_ctx': NUM_CTX,
+}
+
+BUNDLE_OPTIONS = {
+    'temperature': 0.7,
+    'num_predict': 2048,
+    'num_ctx': NUM_CTX,
+}
+
+TRANSLATE_OPTIONS = {
+    'temperature': 0.3,  # Lower temperature for more accurate translation
+    'top_k': 1,  # Greedy decoding: translation gains nothing from sampling
+    'num_predict': 1536,
+    'num_ctx': NUM_CTX,
+}
+
+# Every prompt starts with a static instruction block and only then appends
+# the document and per-request parameters. Keeping that prefix byte-for-byte
+# identical across requests lets Ollama reuse the KV cache for it instead of
+# re-running prefill over the instructions each time.
+
+SUMMARIZE_PROMPT_HEAD = """You are a medical text simplification expert. Your task is to convert complex medical discharge summaries into clear, patient-friendly language.
+
+Guidelines:
+- Use simple, everyday words instead of medical jargon
+- Organize information clearly with sections
+- Maintain medical accuracy
+- Be compassionate and encouraging
+- Explain medical terms when necessary"""
+
+FAQ_PROMPT_HEAD = """You help patients understand their medical summary. Generate frequently asked questions that a patient might have, along with clear, helpful answers.
+
+For each FAQ, provide:
+- question: The patient's question
+- answer: Clear, helpful answer
+- category: One of [Medication, Treatment, Lifestyle, Symptoms, Follow-up, Emergency]
+
+Return ONLY a valid JSON object in this exact format:
+{
+  "faqs": [
+    {
+      "question": "What medications should I take?",
+      "answer": "Clear answer here",
+      "category": "Medication"
+    }
+  ]
+}"""
+
+CARE_PROMPT_HEAD = """You help patients follow their discharge instructions. Create specific, actionable care guidance tasks for the patient.
+
+For each task, provide:
+- title: Brief task title
+- description: Detailed, clear instructions
+- priority: One of [High, Medium, Low]
+- category: One of [Medication, Appointment, Monitoring, Lifestyle, Emergency]
+
+Return ONLY a valid JSON object in this exact format:
+{
+  "care_guidance": [
+    {
+      "title": "Take Medications as Prescribed",
+      "description": "Detailed instructions here",
+      "priority": "High",
+      "category": "Medication"
+    }
+  ]
+}"""
+
+BUNDLE_PROMPT_HEAD = """You are a medical text simplification expert. Read the medical discharge summary that follows these instructions and prepare three things for the patient.
+
+1. simplified_text: A clear, patient-friendly version of the summary.
+   - Use simple, everyday words instead of medical jargon
+   - Organize information clearly with sections
+   - Maintain medical accuracy
+   - Be compassionate and encouraging
+   - Explain medical terms when necessary
+
+2. faqs: Frequently asked questions a patient might have. For each FAQ, provide:
+   - question: The patient's question
+   - answer: Clear, helpful answer
+   - category: One of [Medication, Treatment, Lifestyle, Symptoms, Follow-up, Emergency]
+
+3. care_guidance: Specific, actionable care tasks. For each task, provide:
+   - title: Brief task title
+   - description: Detailed, clear instructions
+   - priority: One of [High, Medium, Low]
+   - category: One of [Medication, Appointment, Monitoring, Lifestyle, Emergency]
+
+Return ONLY a valid JSON object in this exact format:
+{
+  "simplified_text": "You were admitted to the hospital because...",
+  "faqs": [
+    {
+      "question": "What medications should I take?",
+      "answer": "Clear answer here",
+      "category": "Medication"
+    }
+  ],
+  "care_guidance": [
+    {
+      "title": "Take Medications as Prescribed",
+      "description": "Detailed instructions here",
+      "priority": "High",
+      "category": "Medication"
+    }
+  ]
+}"""
+
+TRANSLATE_PROMPT_HEAD_TMPL = """Translate the following medical discharge summary from English to {lang_name}. 
+Maintain a patient-friendly tone and ensure accuracy. {medical_note}"""
+
+def summarize_prompt(text):
+    return f"""{SUMMARIZE_PROMPT_HEAD}
+
+Original Medical Document:
+{text}
+
+Please provide a simplified, patient-friendly version:"""
+
+def summarize_batch_prompt(texts):
+    documents = "\n\n".join(f"Document {i+1}:\n{text}" for i, text in enumerate(texts))
+    return f"""{SUMMARIZE_PROMPT_HEAD}
+
+Simplify each of the following {len(texts)} medical documents independently.
+
+{documents}
+
+Return ONLY a valid JSON object with one simplified, patient-friendly version per document, tagged with its document number:
+{{"results": [{{"id": 1, "text": "simplified version of document 1"}}, {{"id": 2, "text": "simplified version of document 2"}}]}}
+
+JSON:"""
+
+def faq_prompt(text, num_questions):
+    return f"""{FAQ_PROMPT_HEAD}
+
+Medical Summary:
+{text}
+
+Create {num_questions} FAQs.
+
+JSON FAQs:"""
+
+def care_prompt(text, num_items):
+    return f"""{CARE_PROMPT_HEAD}
+
+Medical Summary:
+{text}
+
+Create {num_items} care tasks.
+
+JSON Care Guidance:"""
+
+def bundle_prompt(text, num_questions, num_items):
+    return f"""{BUNDLE_PROMPT_HEAD}
+
+Medical Summary:
+{text}
+
+Include {num_questions} FAQs and {num_items} care tasks.
+
+JSON:"""
+
+def translate_prompt(text, lang_name, medical_note):
+    head = TRANSLATE_PROMPT_HEAD_TMPL.format(lang_name=lang_name, medical_note=medical_note)
+    return f"""{head}
+
+English Text:
+{text}
+
+{lang_name} Translation:"""
+
+def translate_batch_prompt(texts, lang_name, medical_note):
+    head = TRANSLATE_PROMPT_HEAD_TMPL.format(lang_name=lang_name, medical_note=medical_note)
+    documents = "\n\n".join(f"English Text {i+1}:\n{text}" for i, text in enumerate(texts))
+    return f"""{head}
+
+Translate each of the following {len(texts)} texts independently.
+
+{documents}
+
+Return ONLY a valid JSON object with one {lang_name} translation per text, tagged with its text number:
+{{"results": [{{"id": 1, "text": "translation of text 1"}}, {{"id": 2, "text": "translation of text 2"}}]}}
+
+JSON:"""
+
+# ============================================
+# MICRO-BATCHING
+# ============================================
+
+class PromptBatcher:
+    """
+    Collects concurrent requests that share one prompt template and sends
+    them to Ollama as a single packed prompt, so N in-flight requests cost
+    one HTTP round-trip and one scheduling slot instead of N.
+    
+    A batch only grows while the packed prompt plus the scaled num_predict
+    (one output budget per document) still fits in NUM_CTX, so Ollama never
+    has to truncate the packed answer.
+    
+    A lone request is sent with the regular single-document prompt. Packed
+    results are matched to callers by the document number the model tags
+    each one with, never by position; if any number is missing, repeated or
+    unknown, the batch falls back to individual calls.
+    """
+    
+    def __init__(self, model, prompt, batch_prompt, options,
+                 window_ms=BATCH_WINDOW_MS, max_size=BATCH_MAX_SIZE):
+        self.model = model
+        self.prompt = prompt
+        self.batch_prompt = batch_prompt
+        self.options = options
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self.queue = asyncio.Queue()
+        self._carry = None
+        self._worker = None
+        self._dispatches = set()
+    
+    async def submit(self, text):
+        """
+        Queue one document and wait for its generated text, returned with
+        whether it was cut off at num_predict
+        """
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._drain())
+        future = asyncio.get_running_loop().create_future()
+        BATCH_QUEUE_DEPTH.inc()
+        await self.queue.put((text, future))
+        return await future
+    
+    async def _drain(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self._carry is not None:
+                batch, self._carry = [self._carry], None
+            else:
+                batch = [await self.queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if not self._fits([text for text, _ in batch] + [item[0]]):
+                    # Too big to share this batch; it starts the next one
+                    self._carry = item
+                    break
+                batch.append(item)
+            
+            # Dispatch in the background so the next batch can start filling
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+    
+    def _fits(self, texts):
+        """Whether a packed prompt for texts and all of its outputs fit in NUM_CTX"""
+        prompt_tokens = len(self.batch_prompt(texts)) // CHARS_PER_TOKEN
+        return prompt_tokens + self.options['num_predict'] * len(texts) <= NUM_CTX
+    
+    async def _dispatch(self, batch):
+        BATCH_QUEUE_DEPTH.dec(len(batch))
+        texts = [text for text, _ in batch]
+        futures = [future for _, future in batch]
+        try:
+            if len(batch) == 1:
+                results = [await self._generate_one(texts[0])]
+            else:
+                results = await self._generate_many(texts)
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+    
+    async def _generate_one(self, text):
+        response = await generate(
+            model=self.model,
+            prompt=self.prompt(text),
+            options=self.options
+        )
+        return response['response'].strip(), was_truncated(response, self.options['num_predict'])
+    
+    async def _generate_many(self, texts):
+        logger.info("Sending batch of %d documents...", len(texts))
+        # The packed answer holds one output per document
+        num_predict = self.options['num_predict'] * len(texts)
+        response = await generate(
+            model=self.model,
+            prompt=self.batch_prompt(texts),
+            format='json',
+            options={**self.options, 'num_predict': num_predict}
+        )
+        try:
+            # A cut-off packed answer can't say which document lost text
+            if was_truncated(response, num_predict):
+                raise ValueError("Batched response was truncated")
+            results = parse_json_response(response['response'])['results']
+            by_id = {r['id']: r['text'] for r in results}
+            # Every document number exactly once, each with a text
+            if (len(results) == len(texts)
+                    and set(by_id) == set(range(1, len(texts) + 1))
+                    and all(isinstance(t, str) for t in by_id.values())):
+                return [(by_id[i].strip(), False) for i in range(1, len(texts) + 1)]
+        except (ValueError, KeyError, TypeError):
+            pass
+        
+        logger.warning("Batched response could not be split, retrying individually")
+        return await asyncio.gather(*(self._generate_one(text) for text in texts))
+
+_batchers = {}
+
+def get_batcher(key, model, prompt, batch_prompt, options):
+    """Return the batcher for a template key, creating it on first use"""
+    batcher = _batchers.get(key)
+    if batcher is None:
+        batcher = _batchers[key] = PromptBatcher(model, prompt, batch_prompt, options)
+    return batcher
+
+# ============================================
+# MODEL PRELOAD
+# ============================================
+
+async def preload_models():
+    """Load every configured model into memory and keep it resident indefinitely"""
+    # An empty prompt makes Ollama load the model without generating anything
+    for model in dict.fromkeys(MODELS.values()):
+        await client.generate(model=model, prompt='', keep_alive=-1, options={'num_ctx': NUM_CTX})
+
+async def keep_models_loaded():
+    """Preload the models, then re-pin them every KEEP_ALIVE_PING_SECONDS"""
+    try:
+        logger.info("Preloading models %s...", ', '.join(dict.fromkeys(MODELS.values())))
+        await preload_models()
+    except Exception as e:
+        logger.warning("Model preload failed, it will load on first request: %s", e)
+    
+    while True:
+        await asyncio.sleep(KEEP_ALIVE_PING_SECONDS)
+        try:
+            await preload_models()
+        except Exception as e:
+            logger.warning("Model keep-alive ping failed: %s", e)
+
+@app.before_serving
+async def startup():
+    """Move the one-time model load out of the first user request"""
+    logger.info("=" * 50)
+    logger.info("CareBridge Backend Server (worker pid %d)", os.getpid())
+    logger.info("=" * 50)
+    for task, model in MODELS.items():
+        logger.info("Model (%s): %s", task, model)
+    logger.info("=" * 50)
+    
+    # Load in the background: two 7B models can take longer than the server's
+    # startup timeout, and requests can be served (loading lazily) meanwhile
+    app.keep_alive_task = asyncio.create_task(keep_models_loaded())
+
+@app.after_serving
+async def shutdown():
+    app.keep_alive_task.cancel()
 
 # ============================================
 # HEALTH CHECK
 # ============================================
 
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Health check endpoint"""
     try:
         # Check if Ollama is available
-        ollama.list()
-        return jsonify({
+        await client.list()
+        return json_response({
             "status": "ok",
-            "model": OLLAMA_MODEL,
+            "model": MODELS['summarize'],
+            "models": MODELS,
             "message": "Backend is healthy"
         })
     except Exception as e:
-        return jsonify({
+        return json_response({
             "status": "error",
             "message": f"Ollama not available: {str(e)}"
         }), 503
 
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus metrics"""
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        body = generate_latest(registry)
+    else:
+        body = generate_latest()
+    return Response(body, content_type=CONTENT_TYPE_LATEST)
+
 # ============================================
 # SUMMARIZATION
 # ============================================
 
 @app.route('/api/summarize', methods=['POST'])
-def summarize():
+@instrumented('summarize')
+async def summarize():
     """
     Simplify medical text using Ollama
     
@@ -66,56 +866,71 @@ def summarize():
         "options": {
             "tone": "patient-friendly",
             "format": "structured"
-        }
+        },
+        "stream": false
     }
+    
+    With "stream": true the simplified text is streamed back as NDJSON.
     """
     try:
-        data = request.json
+        data = await read_json()
         text = data.get('text', '')
         options = data.get('options', {})
+        stream = data.get('stream', False)
         
         if not text:
-            return jsonify({"error": "No text provided"}), 400
+            return json_response({"error": "No text provided"}), 400
+        if len(text) > MAX_SUMMARIZE_CHARS:
+            return text_too_long(text, MAX_SUMMARIZE_CHARS)
         
-        # Create prompt for medical simplification
-        prompt = f"""You are a medical text simplification expert. Your task is to convert complex medical discharge summaries into clear, patient-friendly language.
-
-Guidelines:
-- Use simple, everyday words instead of medical jargon
-- Organize information clearly with sections
-- Maintain medical accuracy
-- Be compassionate and encouraging
-- Explain medical terms when necessary
-
-Original Medical Document:
-{text}
-
-Please provide a simplified, patient-friendly version:"""
+        cache_key = ResponseCache.key('summarize', text)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return stream_cached(cached) if stream else raw_json_response(cached)
         
         logger.info("Generating simplified summary...")
         
-        # Call Ollama
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
-            prompt=prompt,
-            options={
-                'temperature': 0.7,
-                'top_p': 0.9,
-                'top_k': 40,
-            }
+        batcher = get_batcher(
+            'summarize',
+            MODELS['summarize'],
+            summarize_prompt,
+            summarize_batch_prompt,
+            SUMMARIZE_OPTIONS
         )
         
-        simplified_text = response['response'].strip()
+        # Map-reduce long documents: summarize each chunk, then summarize the
+        # combined chunk summaries below
+        limit = input_limit(summarize_prompt(''), SUMMARIZE_OPTIONS)
+        truncated = False
+        while len(text) > limit:
+            chunks = split_document(text, limit)
+            logger.info("Document too long, summarizing %d chunks first...", len(chunks))
+            summaries, cut_offs = zip(*await asyncio.gather(*(batcher.submit(chunk) for chunk in chunks)))
+            text = "\n\n".join(summaries)
+            truncated = truncated or any(cut_offs)
+        
+        if stream:
+            return stream_generation(
+                MODELS['summarize'],
+                summarize_prompt(text),
+                SUMMARIZE_OPTIONS,
+                cache_key,
+                'simplified_text',
+                {"model": MODELS['summarize']},
+                truncated
+            )
         
-        return jsonify({
+        simplified_text, cut_off = await batcher.submit(text)
+        
+        return cache_response(cache_key, {
             "simplified_text": simplified_text,
-            "model": OLLAMA_MODEL,
+            "model": MODELS['summarize'],
             "success": True
-        })
+        }, truncated or cut_off)
         
     except Exception as e:
-        logger.error(f"Summarization error: {str(e)}")
-        return jsonify({
+        logger.error("Summarization error: %s", e)
+        return json_response({
             "error": str(e),
             "success": False
         }), 500
@@ -125,7 +940,8 @@ Please provide a simplified, patient-friendly version:"""
 # ============================================
 
 @app.route('/api/generate-faq', methods=['POST'])
-def generate_faq():
+@instrumented('generate-faq')
+async def generate_faq():
     """
     Generate patient-oriented FAQs
     
@@ -136,73 +952,50 @@ def generate_faq():
     }
     """
     try:
-        data = request.json
+        data = await read_json()
         text = data.get('text', '')
         num_questions = data.get('num_questions', 6)
         
         if not text:
-            return jsonify({"error": "No text provided"}), 400
+            return json_response({"error": "No text provided"}), 400
+        limit = input_limit(faq_prompt('', num_questions), FAQ_OPTIONS)
+        if len(text) > limit:
+            return text_too_long(text, limit)
         
-        prompt = f"""Based on this medical summary, generate {num_questions} frequently asked questions that a patient might have, along with clear, helpful answers.
-
-Medical Summary:
-{text}
-
-Create {num_questions} FAQs. For each FAQ, provide:
-- question: The patient's question
-- answer: Clear, helpful answer
-- category: One of [Medication, Treatment, Lifestyle, Symptoms, Follow-up, Emergency]
-
-Return ONLY a valid JSON array in this exact format:
-[
-  {{
-    "question": "What medications should I take?",
-    "answer": "Clear answer here",
-    "category": "Medication"
-  }}
-]
-
-JSON FAQs:"""
+        cache_key = ResponseCache.key('generate-faq', text, num_questions)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return raw_json_response(cached)
+        
+        prompt = faq_prompt(text, num_questions)
         
         logger.info("Generating FAQs...")
         
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
+        response = await generate(
+            model=MODELS['faq'],
             prompt=prompt,
-            options={'temperature': 0.7}
+            format='json',
+            options=FAQ_OPTIONS
         )
         
-        # Parse JSON response
-        response_text = response['response'].strip()
+        faqs = add_faq_ids(json_list(parse_json_response(response['response']), 'faqs'))
         
-        # Try to extract JSON if it's wrapped in markdown
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in response_text:
-            response_text = response_text.split('```')[1].split('```')[0].strip()
-        
-        faqs = json.loads(response_text)
-        
-        # Add IDs
-        for i, faq in enumerate(faqs):
-            faq['id'] = f'faq-{i+1}'
-        
-        return jsonify({
+        return cache_response(cache_key, {
             "faqs": faqs,
             "success": True
         })
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {str(e)}")
-        logger.error(f"Response: {response['response']}")
-        return jsonify({
+    except (orjson.JSONDecodeError, ModelOutputError) as e:
+        # Log only the start of the output; it can be several KB per failure
+        logger.error("JSON parsing error: %s (response starts: %r)", e, response['response'][:400])
+        return json_response({
             "error": "Failed to parse FAQs",
             "raw_response": response.get('response', ''),
             "success": False
         }), 500
     except Exception as e:
-        logger.error(f"FAQ generation error: {str(e)}")
-        return jsonify({
+        logger.error("FAQ generation error: %s", e)
+        return json_response({
             "error": str(e),
             "success": False
         }), 500
@@ -212,7 +1005,8 @@ JSON FAQs:"""
 # ============================================
 
 @app.route('/api/care-guidance', methods=['POST'])
-def care_guidance():
+@instrumented('care-guidance')
+async def care_guidance():
     """
     Generate care guidance tasks
     
@@ -223,75 +1017,124 @@ def care_guidance():
     }
     """
     try:
-        data = request.json
+        data = await read_json()
         text = data.get('text', '')
         num_items = data.get('num_items', 7)
         
         if not text:
-            return jsonify({"error": "No text provided"}), 400
+            return json_response({"error": "No text provided"}), 400
+        limit = input_limit(care_prompt('', num_items), CARE_OPTIONS)
+        if len(text) > limit:
+            return text_too_long(text, limit)
         
-        prompt = f"""Based on this medical summary, create {num_items} specific, actionable care guidance tasks for the patient.
-
-Medical Summary:
-{text}
-
-Create {num_items} care tasks. For each task, provide:
-- title: Brief task title
-- description: Detailed, clear instructions
-- priority: One of [High, Medium, Low]
-- category: One of [Medication, Appointment, Monitoring, Lifestyle, Emergency]
-
-Return ONLY a valid JSON array in this exact format:
-[
-  {{
-    "title": "Take Medications as Prescribed",
-    "description": "Detailed instructions here",
-    "priority": "High",
-    "category": "Medication"
-  }}
-]
-
-JSON Care Guidance:"""
+        cache_key = ResponseCache.key('care-guidance', text, num_items)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return raw_json_response(cached)
+        
+        prompt = care_prompt(text, num_items)
         
         logger.info("Generating care guidance...")
         
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
+        response = await generate(
+            model=MODELS['care'],
             prompt=prompt,
-            options={'temperature': 0.7}
+            format='json',
+            options=CARE_OPTIONS
         )
         
-        # Parse JSON response
-        response_text = response['response'].strip()
+        guidance = add_care_ids(json_list(parse_json_response(response['response']), 'care_guidance'))
+        
+        return cache_response(cache_key, {
+            "care_guidance": guidance,
+            "success": True
+        })
+        
+    except (orjson.JSONDecodeError, ModelOutputError) as e:
+        # Log only the start of the output; it can be several KB per failure
+        logger.error("JSON parsing error: %s (response starts: %r)", e, response['response'][:400])
+        return json_response({
+            "error": "Failed to parse care guidance",
+            "raw_response": response.get('response', ''),
+            "success": False
+        }), 500
+    except Exception as e:
+        logger.error("Care guidance error: %s", e)
+        return json_response({
+            "error": str(e),
+            "success": False
+        }), 500
+
+# ============================================
+# BUNDLE (SUMMARY + FAQ + CARE GUIDANCE)
+# ============================================
+
+@app.route('/api/bundle', methods=['POST'])
+@instrumented('bundle')
+async def bundle():
+    """
+    Generate the simplified summary, FAQs and care guidance in one LLM call.
+    The document is sent to the model once instead of three times.
+    
+    Body:
+    {
+        "text": "original medical document",
+        "num_questions": 6,
+        "num_items": 7
+    }
+    """
+    try:
+        data = await read_json()
+        text = data.get('text', '')
+        num_questions = data.get('num_questions', 6)
+        num_items = data.get('num_items', 7)
+        
+        if not text:
+            return json_response({"error": "No text provided"}), 400
+        limit = input_limit(bundle_prompt('', num_questions, num_items), BUNDLE_OPTIONS)
+        if len(text) > limit:
+            return text_too_long(text, limit)
         
-        # Try to extract JSON if it's wrapped in markdown
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0].strip()
-        elif '```' in response_text:
-            response_text = response_text.split('```')[1].split('```')[0].strip()
+        cache_key = ResponseCache.key('bundle', text, num_questions, num_items)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return raw_json_response(cached)
         
-        guidance = json.loads(response_text)
+        prompt = bundle_prompt(text, num_questions, num_items)
         
-        # Add IDs
-        for i, item in enumerate(guidance):
-            item['id'] = i + 1
+        logger.info("Generating summary, FAQs and care guidance...")
         
-        return jsonify({
-            "care_guidance": guidance,
+        response = await generate(
+            model=MODELS['bundle'],
+            prompt=prompt,
+            format='json',
+            options=BUNDLE_OPTIONS
+        )
+        
+        result = parse_json_response(response['response'])
+        simplified_text = result.get('simplified_text') if isinstance(result, dict) else None
+        if not isinstance(simplified_text, str):
+            raise ModelOutputError("Expected a string under 'simplified_text'")
+        
+        return cache_response(cache_key, {
+            "simplified_text": simplified_text.strip(),
+            "faqs": add_faq_ids(json_list(result, 'faqs')),
+            "care_guidance": add_care_ids(json_list(result, 'care_guidance')),
+            "model": MODELS['bundle'],
             "success": True
         })
         
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON parsing error: {str(e)}")
-        logger.error(f"Response: {response['response']}")
-        return jsonify({
-            "error": "Failed to parse care guidance",
+    except (orjson.JSONDecodeError, ModelOutputError) as e:
+        # Log only the start of the output; it can be several KB per failure
+        logger.error("JSON parsing error: %s (response starts: %r)", e, response['response'][:400])
+        return json_response({
+            "error": "Failed to parse bundle",
             "raw_response": response.get('response', ''),
             "success": False
         }), 500
     except Exception as e:
-        logger.error(f"Care guidance error: {str(e)}")
-        return jsonify({
+        logger.error("Bundle generation error: %s", e)
+        return json_response({
             "error": str(e),
             "success": False
         }), 500
@@ -301,7 +1144,8 @@ JSON Care Guidance:"""
 # ============================================
 
 @app.route('/api/translate', methods=['POST'])
-def translate():
+@instrumented('translate')
+async def translate():
     """
     Translate text to Hindi or Kannada
     
@@ -309,17 +1153,26 @@ def translate():
     {
         "text": "english text",
         "target_language": "hi" or "kn",
-        "preserve_medical_terms": true
+        "preserve_medical_terms": true,
+        "stream": false
     }
+    
+    With "stream": true the translation is streamed back as NDJSON.
     """
     try:
-        data = request.json
+        data = await read_json()
         text = data.get('text', '')
         target_lang = data.get('target_language', 'hi')
         preserve_medical = data.get('preserve_medical_terms', True)
+        stream = data.get('stream', False)
         
         if not text:
-            return jsonify({"error": "No text provided"}), 400
+            return json_response({"error": "No text provided"}), 400
+        
+        cache_key = ResponseCache.key('translate', text, target_lang, preserve_medical)
+        cached = response_cache.get(cache_key)
+        if cached is not None:
+            return stream_cached(cached) if stream else raw_json_response(cached)
         
         lang_names = {
             'hi': 'Hindi',
@@ -330,33 +1183,40 @@ def translate():
         
         medical_note = "Keep important medical terms in English (in parentheses if needed) to avoid confusion." if preserve_medical else ""
         
-        prompt = f"""Translate the following medical discharge summary from English to {lang_name}. 
-Maintain a patient-friendly tone and ensure accuracy. {medical_note}
-
-English Text:
-{text}
-
-{lang_name} Translation:"""
+        limit = input_limit(translate_prompt('', lang_name, medical_note), TRANSLATE_OPTIONS)
+        if len(text) > limit:
+            return text_too_long(text, limit)
         
-        logger.info(f"Translating to {lang_name}...")
+        logger.info("Translating to %s...", lang_name)
         
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
-            prompt=prompt,
-            options={'temperature': 0.3}  # Lower temperature for more accurate translation
-        )
+        if stream:
+            return stream_generation(
+                MODELS['translate'],
+                translate_prompt(text, lang_name, medical_note),
+                TRANSLATE_OPTIONS,
+                cache_key,
+                'translated_text',
+                {"target_language": target_lang}
+            )
         
-        translated_text = response['response'].strip()
+        batcher = get_batcher(
+            ('translate', lang_name, medical_note),
+            MODELS['translate'],
+            functools.partial(translate_prompt, lang_name=lang_name, medical_note=medical_note),
+            functools.partial(translate_batch_prompt, lang_name=lang_name, medical_note=medical_note),
+            TRANSLATE_OPTIONS
+        )
+        translated_text, truncated = await batcher.submit(text)
         
-        return jsonify({
+        return cache_response(cache_key, {
             "translated_text": translated_text,
             "target_language": target_lang,
             "success": True
-        })
+        }, truncated)
         
     except Exception as e:
-        logger.error(f"Translation error: {str(e)}")
-        return jsonify({
+        logger.error("Translation error: %s", e)
+        return json_response({
             "error": str(e),
             "success": False
         }), 500
@@ -367,38 +1227,22 @@ English Text:
 
 @app.errorhandler(404)
 def not_found(e):
-    return jsonify({
+    return json_response({
         "error": "Endpoint not found",
         "available_endpoints": [
             "GET /health",
+            "GET /metrics",
             "POST /api/summarize",
             "POST /api/generate-faq",
             "POST /api/care-guidance",
+            "POST /api/bundle",
             "POST /api/translate"
         ]
     }), 404
 
 @app.errorhandler(500)
 def internal_error(e):
-    return jsonify({
+    return json_response({
         "error": "Internal server error",
         "message": str(e)
     }), 500
-
-# ============================================
-# MAIN
-# ============================================
-
-if __name__ == '__main__':
-    logger.info("=" * 50)
-    logger.info("CareBridge Backend Server")
-    logger.info("=" * 50)
-    logger.info(f"Model: {OLLAMA_MODEL}")
-    logger.info("Starting server on http://localhost:3001")
-    logger.info("=" * 50)
-    
-    app.run(
-        host='0.0.0.0',
-        port=3001,
-        debug=True
-    )